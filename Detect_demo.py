@@ -1,36 +1,47 @@
 """Streamlit tutorial: NVIDIA Grounding DINO object detection via API."""
 # --- Imports ---------------------------------------------------------------
+import hashlib
 import io
+import itertools
 import json
+import logging
 import os
+import tempfile
 import time
-import uuid
 import zipfile
-from typing import Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Dict, List, Optional, Tuple, Union
 
+import numpy as np
 import requests
-from PIL import Image, ImageDraw, ImageFont
+from requests.adapters import HTTPAdapter
+from PIL import Image, ImageColor, ImageDraw, ImageFont
 import streamlit as st
 
+try:  # faster JSON parsing when available; stdlib keeps the tutorial runnable
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+logger = logging.getLogger(__name__)
+
 # --- Streamlit Page Setup --------------------------------------------------
 st.set_page_config(page_title="Andya's Detector", page_icon="🔍", layout="centered")
 st.title("Andy's Detector")
 
 # Simple inputs so learners can follow along
 prompt = st.text_input("Prompt", value="find all objects")
-uploaded_file = st.file_uploader(
-    "Image",
+uploaded_files = st.file_uploader(
+    "Images",
     type=["jpg", "jpeg", "png", "bmp", "webp"],
-    accept_multiple_files=False,
+    accept_multiple_files=True,
 )
 
-if uploaded_file:
-    st.image(uploaded_file, use_container_width=True)
+for uploaded_file in uploaded_files:
+    st.image(uploaded_file, caption=uploaded_file.name, use_container_width=True)
 
-if "result_image" not in st.session_state:
-    st.session_state["result_image"] = None
-if "detections" not in st.session_state:
-    st.session_state["detections"] = []
+if "results" not in st.session_state:
+    st.session_state["results"] = []
 
 
 # --- Section 1: API + Deep Learning Utilities -----------------------------
@@ -39,10 +50,29 @@ NVAI_URL = "https://ai.api.nvidia.com/v1/cv/nvidia/nv-grounding-dino"
 NVAI_POLLING_URL = "https://api.nvcf.nvidia.com/v2/nvcf/pexec/status/"
 ASSETS_URL = "https://api.nvcf.nvidia.com/v2/nvcf/assets"
 UPLOAD_ASSET_TIMEOUT = 300
-MAX_RETRIES = 5
-DELAY_BTW_RETRIES = 1
-def _auth_value() -> str:
-    """Read the API token from Streamlit secrets or environment."""
+POLL_DEADLINE = 120
+POLL_INITIAL_DELAY = 0.1
+POLL_MAX_DELAY = 2.0
+PREVIEW_MAX_SIDE = 1920
+MAX_PARALLEL_REQUESTS = 8
+BOX_LINE_WIDTH = 3
+BOX_COLORS = [ImageColor.getrgb(c) for c in ("#f97316", "#2563eb", "#16a34a", "#db2777", "#7c3aed")]
+SPOOL_MAX_MEMORY = 8 << 20  # larger zip responses spill to a temp file
+# One pooled session so repeated calls reuse TCP/TLS connections.
+# No session-wide "accept" header: the inference call expects a zip, not JSON.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+try:  # loaded once per process; annotate() reuses it on every click
+    _DEFAULT_FONT = ImageFont.load_default()
+except OSError:  # PIL then draws with its own built-in default
+    _DEFAULT_FONT = None
+# The legacy bitmap font is monospaced, so one glyph's metrics size every label.
+_FONT_CHAR_SIZE = (
+    tuple(_DEFAULT_FONT.getbbox("M")[2:]) if type(_DEFAULT_FONT) is ImageFont.ImageFont else None
+)
+@st.cache_resource(show_spinner=False)
+def _load_auth() -> str:
+    """Resolve the API token once per process (restart to pick up a new key)."""
     return (
         st.secrets.get("NVIDIA_API_KEY")
         or st.secrets.get("API_KEY")
@@ -50,6 +80,9 @@ def _auth_value() -> str:
         or os.getenv("NGC_PERSONAL_API_KEY")
         or ""
     )
+def _auth_value() -> str:
+    """Read the API token from Streamlit secrets or environment."""
+    return _load_auth()
 def _upload_asset(data: bytes, description: str, content_type: str) -> str:
     """Upload the raw image to NVIDIA's asset storage and return its ID."""
     headers = {"Content-Type": "application/json", "accept": "application/json"}
@@ -58,22 +91,41 @@ def _upload_asset(data: bytes, description: str, content_type: str) -> str:
         headers["Authorization"] = f"Bearer {auth}"
 
     payload = {"contentType": content_type, "description": description}
-    response = requests.post(ASSETS_URL, headers=headers, json=payload, timeout=60)
+    response = _SESSION.post(ASSETS_URL, headers=headers, json=payload, timeout=60)
     response.raise_for_status()
 
     meta = response.json()
     upload_url = meta["uploadUrl"]
-    asset_id = str(uuid.UUID(meta["assetId"]))
+    asset_id = meta["assetId"]  # already a canonical UUID string
 
     s3_headers = {
         "x-amz-meta-nvcf-asset-description": description,
         "content-type": content_type,
     }
-    response = requests.put(upload_url, data=data, headers=s3_headers, timeout=UPLOAD_ASSET_TIMEOUT)
+    response = _SESSION.put(upload_url, data=data, headers=s3_headers, timeout=UPLOAD_ASSET_TIMEOUT)
     response.raise_for_status()
     return asset_id
-def _request_zip(asset_id: str, prompt_text: str, content_type: str) -> bytes:
-    """Call nv-grounding-dino and return the zipped response bytes."""
+def _next_poll_delay(attempt: int, retry_after: Optional[str], remaining: float) -> float:
+    """Back off exponentially, but follow the server's Retry-After hint if sent.
+
+    A hint is honored up to the time left before the polling deadline.
+    """
+    if retry_after:
+        try:
+            return min(max(0.0, float(retry_after)), max(0.0, remaining))
+        except ValueError:
+            pass
+    return min(POLL_MAX_DELAY, POLL_INITIAL_DELAY * 2**attempt)
+def _spool(response: requests.Response) -> IO[bytes]:
+    """Copy a streamed response into a spooled temp file, rewound for reading."""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    with response:  # hands the connection back to the session pool when done
+        for chunk in response.iter_content(chunk_size=1 << 16):
+            spool.write(chunk)
+    spool.seek(0)
+    return spool
+def _request_zip(asset_id: str, prompt_text: str, content_type: str) -> Optional[IO[bytes]]:
+    """Call nv-grounding-dino and return the zipped response as a file object."""
     auth = _auth_value()
     headers = {
         "Content-Type": "application/json",
@@ -100,143 +152,280 @@ def _request_zip(asset_id: str, prompt_text: str, content_type: str) -> bytes:
         "threshold": 0.3,
     }
 
-    response = requests.post(NVAI_URL, headers=headers, json=payload, timeout=120)
+    response = _SESSION.post(NVAI_URL, headers=headers, json=payload, timeout=120, stream=True)
     if response.status_code == 200:
-        return response.content
+        return _spool(response)
     if response.status_code == 202:
         reqid = response.headers.get("NVCF-REQID", "")
+        response.close()  # streamed bodies we never read must be closed to free the socket
         poll_headers = {"accept": "application/json"}
         if auth:
             poll_headers["Authorization"] = f"Bearer {auth}"
         poll_url = f"{NVAI_POLLING_URL}{reqid}"
-        retries = MAX_RETRIES
-        while retries > 0:
-            time.sleep(DELAY_BTW_RETRIES)
-            poll = requests.get(poll_url, headers=poll_headers, timeout=120)
+        started = time.monotonic()
+        deadline = started + POLL_DEADLINE
+        delay = POLL_INITIAL_DELAY
+        attempt = 0
+        while time.monotonic() < deadline:
+            time.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+            attempt += 1
+            poll = _SESSION.get(poll_url, headers=poll_headers, timeout=120, stream=True)
             if poll.status_code == 200:
-                return poll.content
+                return _spool(poll)
+            poll.close()
             if poll.status_code != 202:
-                break
-            retries -= 1
-        return b""
-    response.raise_for_status()
-    return response.content
+                logger.warning(
+                    "Polling %s stopped with HTTP %s after %d attempts (%.1fs)",
+                    reqid, poll.status_code, attempt, time.monotonic() - started,
+                )
+                return None
+            delay = _next_poll_delay(
+                attempt, poll.headers.get("Retry-After"), deadline - time.monotonic()
+            )
+        logger.warning(
+            "Polling %s timed out after %d attempts (%.1fs)",
+            reqid, attempt, time.monotonic() - started,
+        )
+        return None
+    if not response.ok:
+        response.close()  # raise_for_status only needs the status line
+        response.raise_for_status()
+    return _spool(response)
+_LIST_KEYS = ("predictions", "detections", "objects", "results", "data")
+_BBOX_KEYS = ("bbox", "box", "bounding_box")
+@st.cache_data(show_spinner=False, max_entries=8)
 def _extract_detections(data, width: int, height: int) -> List[Dict[str, float]]:
     """Normalize detection JSON into label, score, and pixel bbox."""
-    items: List[Dict[str, float]] = []
     if isinstance(data, dict):
-        for key in ("predictions", "detections", "objects", "results", "data"):
-            if isinstance(data.get(key), list):
-                items = data[key]
-                break
-        else:
-            items = [data]
-    elif isinstance(data, list):
-        items = data
+        data_get = data.get
+        items = next(
+            (data[key] for key in _LIST_KEYS if isinstance(data_get(key), list)),
+            # a bare dict only counts as one detection if it actually carries a box
+            [data] if any(key in data for key in _BBOX_KEYS) else [],
+        )
+    else:
+        items = data if isinstance(data, list) else []
 
     detections: List[Dict[str, float]] = []
+    raw_boxes: List[List[float]] = []
     for item in items:
         if not isinstance(item, dict):
             continue
-        bbox_info = item.get("bbox") or item.get("box") or item.get("bounding_box") or {}
-        bbox = _to_pixels(bbox_info, width, height)
+        item_get = item.get
+        bbox_info = item_get("bbox") or item_get("box") or item_get("bounding_box") or {}
+        raw_boxes.append(_raw_box(bbox_info))
         detections.append(
             {
-                "label": str(item.get("label") or item.get("class") or item.get("text") or "object"),
-                "confidence": float(item.get("confidence") or item.get("score") or 0),
-                "bbox": bbox,
+                "label": str(item_get("label") or item_get("class") or item_get("text") or "object"),
+                "confidence": float(item_get("confidence") or item_get("score") or 0),
             }
         )
+    if detections:
+        pixels = _to_pixels_batch(np.asarray(raw_boxes, dtype=float), width, height)
+        for detection, bbox in zip(detections, pixels.tolist()):
+            detection["bbox"] = bbox
     return detections
-def _parse_zip(zip_bytes: bytes, width: int, height: int) -> Tuple[List[Dict[str, float]], bytes]:
-    """Read detections and annotated image from the returned zip file."""
-    if not zip_bytes:
+def _content_key(file: IO[bytes]) -> str:
+    """Hash a file's contents so cached parsers can key on it."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(1 << 16), b""):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+@st.cache_data(show_spinner=False, max_entries=8)
+def _parse_zip(
+    zip_key: str, _zip_file: Optional[IO[bytes]], width: int, height: int
+) -> Tuple[List[Dict[str, float]], bytes]:
+    """Read detections and annotated image from the returned zip file.
+
+    ``zip_key`` is the content hash Streamlit caches on; the underscore keeps
+    the file object itself out of the cache key.
+    """
+    if _zip_file is None:
         return [], b""
 
     detections: List[Dict[str, float]] = []
     annotated: bytes = b""
 
-    with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zf:
-        for name in zf.namelist():
-            lower = name.lower()
+    with zipfile.ZipFile(_zip_file) as zf:
+        for info in zf.infolist():
+            lower = info.filename.lower()
             if not annotated and lower.endswith((".png", ".jpg", ".jpeg", ".webp")):
-                annotated = zf.read(name)
+                annotated = zf.read(info)
             if lower.endswith(".json"):
                 try:
-                    data = json.loads(zf.read(name).decode("utf-8"))
+                    data = _json_loads(zf.read(info))
                 except Exception:  # tutorial keeps handling simple
                     continue
                 detections.extend(_extract_detections(data, width, height))
+            if annotated and detections:  # skip any remaining thumbnails/metadata
+                break
 
     return detections, annotated
-def _to_pixels(box: Dict[str, float], width: int, height: int) -> List[float]:
-    """Convert normalized or absolute bbox values into pixels."""
+def _raw_box(box: Dict[str, float]) -> List[float]:
+    """Read a bbox as [x, y, w, h] in whatever units the API used."""
     x = float(box.get("x") or box.get("xmin") or 0)
     y = float(box.get("y") or box.get("ymin") or 0)
     w = float(box.get("width") or (box.get("xmax", 0) - x))
     h = float(box.get("height") or (box.get("ymax", 0) - y))
-    if 0 <= x <= 1 and 0 <= w <= 1:
-        x *= width
-        w *= width
-    if 0 <= y <= 1 and 0 <= h <= 1:
-        y *= height
-        h *= height
-    return [x, y, x + w, y + h]
-def annotate(image_bytes: bytes, detections: List[Dict[str, float]]) -> bytes:
-    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-    draw = ImageDraw.Draw(image)
-    font = ImageFont.load_default()
-    colors = ["#f97316", "#2563eb", "#16a34a", "#db2777", "#7c3aed"]
+    return [x, y, w, h]
+def _to_pixels_batch(boxes: np.ndarray, width: int, height: int) -> np.ndarray:
+    """Convert an (N, 4) array of normalized or absolute [x, y, w, h] into pixel corners."""
+    x, y, w, h = boxes.T
+    # an axis counts as normalized when both its offset and extent lie in [0, 1]
+    scale_x = np.where((x >= 0) & (x <= 1) & (w >= 0) & (w <= 1), width, 1.0)
+    scale_y = np.where((y >= 0) & (y <= 1) & (h >= 0) & (h <= 1), height, 1.0)
+    x, w = x * scale_x, w * scale_x
+    y, h = y * scale_y, h * scale_y
+    return np.stack([x, y, x + w, y + h], axis=1)
+def _fill_rect(pixels: np.ndarray, x0: float, y0: float, x1: float, y1: float, color) -> None:
+    """Paint the inclusive pixel rectangle (x0, y0)-(x1, y1), clipped to the image."""
+    height, width = pixels.shape[:2]
+    x0, y0 = max(0, round(x0)), max(0, round(y0))
+    x1, y1 = min(width - 1, round(x1)), min(height - 1, round(y1))
+    if x0 <= x1 and y0 <= y1:
+        pixels[y0 : y1 + 1, x0 : x1 + 1] = color
+@st.cache_data(show_spinner=False, max_entries=8)
+def annotate(
+    image_key: str,
+    _image: Image.Image,
+    detections: List[Dict[str, float]],
+    source_size: Optional[Tuple[int, int]] = None,
+) -> bytes:
+    """Draw boxes on the image; cached on ``image_key`` (a content hash) and detections."""
+    image = _image  # decoded lazily below, so cache hits never touch the pixels
+    source_format = _image.format  # the rebuilt image below has no format, so read it first
+    # bboxes are in source pixels; rescale them if the image was draft-decoded smaller
+    scale_x = scale_y = 1.0
+    if source_size and source_size != image.size:
+        scale_x = image.width / source_size[0]
+        scale_y = image.height / source_size[1]
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    draw = ImageDraw.Draw(image)  # only measures text; nothing is drawn on the caller's image
+    font = _DEFAULT_FONT
+    colors = itertools.cycle(BOX_COLORS)
+    # Boxes and label backgrounds are opaque, so paint them straight into one
+    # pixel array and leave PIL a single pass for the text.
+    pixels = np.array(image)
+    labels: List[Tuple[Tuple[float, float], str]] = []
+    line = BOX_LINE_WIDTH - 1
 
-    for idx, item in enumerate(detections):
+    for item in detections:
+        color = next(colors)  # advance even for skipped items so colors match list order
         bbox = item.get("bbox")
         if not bbox:
             continue
         x_min, y_min, x_max, y_max = bbox
-        color = colors[idx % len(colors)]
-        draw.rectangle([x_min, y_min, x_max, y_max], outline=color, width=3)
+        x_min, x_max = x_min * scale_x, x_max * scale_x
+        y_min, y_max = y_min * scale_y, y_max * scale_y
+        _fill_rect(pixels, x_min, y_min, x_max, y_min + line, color)
+        _fill_rect(pixels, x_min, y_max - line, x_max, y_max, color)
+        _fill_rect(pixels, x_min, y_min, x_min + line, y_max, color)
+        _fill_rect(pixels, x_max - line, y_min, x_max, y_max, color)
 
         text = item.get("label", "object")
         score = item.get("confidence")
         if score is not None:
-            text += f" {score:.2f}"
-        text_box = draw.textbbox((0, 0), text, font=font)
+            text = "%s %.2f" % (text, score)
+        if _FONT_CHAR_SIZE is not None:
+            text_w, text_h = _FONT_CHAR_SIZE[0] * len(text), _FONT_CHAR_SIZE[1]
+        else:  # variable-width TrueType font
+            text_box = draw.textbbox((0, 0), text, font=font)
+            text_w, text_h = text_box[2] - text_box[0], text_box[3] - text_box[1]
         padding = 3
         background = [
             x_min,
-            max(0, y_min - (text_box[3] - text_box[1]) - padding * 2),
-            x_min + (text_box[2] - text_box[0]) + padding * 2,
-            max((text_box[3] - text_box[1]) + padding * 2, y_min),
+            max(0, y_min - text_h - padding * 2),
+            x_min + text_w + padding * 2,
+            max(text_h + padding * 2, y_min),
         ]
-        draw.rectangle(background, fill=color)
-        draw.text((background[0] + padding, background[1] + padding), text, fill="white", font=font)
+        _fill_rect(pixels, *background, color)
+        labels.append(((background[0] + padding, background[1] + padding), text))
+
+    image = Image.fromarray(pixels)
+    draw = ImageDraw.Draw(image)
+    for position, text in labels:
+        draw.text(position, text, fill="white", font=font)
 
     buffer = io.BytesIO()
-    image.save(buffer, format="PNG")
+    if source_format in ("JPEG", "MPO"):  # camera JPEGs often open as MPO; PNG is several times larger
+        image.save(buffer, format="JPEG", quality=85)
+    else:
+        image.save(buffer, format="PNG", optimize=True)
     return buffer.getvalue()
-def detect(image_bytes: bytes, prompt_text: str, content_type: str) -> Tuple[List[Dict[str, float]], bytes]:
-    """High-level helper: upload, request detections, unpack results."""
-    content_type = content_type or "image/png"
-    asset_id = _upload_asset(image_bytes, "Input Asset", content_type)
-    zip_bytes = _request_zip(asset_id, prompt_text, content_type)
+def _fetch_zip(image_bytes: bytes, prompt_text: str, content_type: str) -> Optional[IO[bytes]]:
+    """Network half of detect(): upload one image and fetch its result zip."""
+    asset_id = _upload_asset(image_bytes, "Input Asset", content_type or "image/png")
+    return _request_zip(asset_id, prompt_text, content_type or "image/png")
+def _unpack(image_bytes: bytes, zip_file: Optional[IO[bytes]]) -> Tuple[List[Dict[str, float]], bytes]:
+    """Local half of detect(): parse the zip, drawing a preview if it has none."""
     image = Image.open(io.BytesIO(image_bytes))
-    width, height = image.size
-    detections, annotated_bytes = _parse_zip(zip_bytes, width, height)
+    width, height = image.size  # header only; the original size the API boxes refer to
+    try:
+        zip_key = _content_key(zip_file) if zip_file is not None else ""
+        detections, annotated_bytes = _parse_zip(zip_key, zip_file, width, height)
+    finally:
+        if zip_file is not None:
+            zip_file.close()
     if not annotated_bytes:  # fallback when API zip has no image preview inside
-        annotated_bytes = annotate(image_bytes, detections)
+        if max(width, height) > PREVIEW_MAX_SIDE:
+            # keep the aspect ratio: a square target would be bound by the short side
+            k = PREVIEW_MAX_SIDE / max(width, height)
+            image.draft("RGB", (round(width * k), round(height * k)))  # JPEG-only DCT downscale
+        image_key = hashlib.sha256(image_bytes).hexdigest()
+        annotated_bytes = annotate(image_key, image, detections, (width, height))
     return detections, annotated_bytes
+def detect(image_bytes: bytes, prompt_text: str, content_type: str) -> Tuple[List[Dict[str, float]], bytes]:
+    """High-level helper: upload, request detections, unpack results."""
+    return _unpack(image_bytes, _fetch_zip(image_bytes, prompt_text, content_type))
+def detect_many(
+    images: List[Tuple[bytes, str]], prompt_text: str
+) -> List[Union[Tuple[List[Dict[str, float]], bytes], Exception]]:
+    """Run detect() over several (image_bytes, content_type) pairs, results in input order.
+
+    Uploads and inference calls run on a thread pool so the round-trips overlap;
+    parsing stays on the script thread, where Streamlit's caches live. A file
+    that fails gets its exception in its slot instead of sinking the batch.
+    """
+    _auth_value()  # resolve the cached token here rather than inside the workers
+    results: List[Union[Tuple[List[Dict[str, float]], bytes], Exception]] = []
+    with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_REQUESTS, len(images) or 1)) as pool:
+        futures = [pool.submit(_fetch_zip, data, prompt_text, kind) for data, kind in images]
+        try:
+            for (image_bytes, _), future in zip(images, futures):
+                try:
+                    results.append(_unpack(image_bytes, future.result()))
+                except Exception as exc:  # tutorial keeps handling simple
+                    results.append(exc)
+        finally:
+            # if the loop was interrupted, close the spools nobody will read
+            for future in futures[len(results):]:
+                if not future.cancel() and future.exception() is None and future.result():
+                    future.result().close()
+    return results
 
 # --- Section 2: Web UI Wiring ---------------------------------------------
 # This layer calls the helpers above and shows results in Streamlit.
-if st.button("Run Detection") and uploaded_file and prompt.strip():
-    image_bytes = uploaded_file.getvalue()
-    detections, annotated_bytes = detect(image_bytes, prompt.strip(), uploaded_file.type)
-    st.session_state["detections"] = detections
-    st.session_state["result_image"] = annotated_bytes
-
-if st.session_state.get("result_image"):
-    st.image(Image.open(io.BytesIO(st.session_state["result_image"])), use_container_width=True)
-    for item in st.session_state.get("detections", []):
+if st.button("Run Detection") and uploaded_files and prompt.strip():
+    images = [(uploaded_file.getvalue(), uploaded_file.type) for uploaded_file in uploaded_files]
+    results = []
+    for uploaded_file, outcome in zip(uploaded_files, detect_many(images, prompt.strip())):
+        if isinstance(outcome, Exception):
+            results.append({"name": uploaded_file.name, "error": str(outcome)})
+        else:
+            detections, annotated_bytes = outcome
+            results.append({"name": uploaded_file.name, "detections": detections, "image": annotated_bytes})
+    st.session_state["results"] = results
+
+for result in st.session_state.get("results", []):
+    if result.get("error"):
+        st.error(f"{result['name']}: {result['error']}")
+        continue
+    if not result.get("image"):
+        continue
+    st.image(result["image"], caption=result["name"], use_container_width=True)
+    for item in result.get("detections", []):
         label = item.get("label", "object")
         score = item.get("confidence")
         bbox = item.get("bbox")
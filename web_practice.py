@@ -2,8 +2,14 @@ import streamlit as st
 
 st.set_page_config(page_title="Mini Layout Playground", page_icon="🎨", layout="wide")
 
-st.markdown(
-    """
+
+@st.cache_data
+def _parse_highlights(raw: str) -> list[str]:
+    """Split the highlights box into trimmed, non-empty lines."""
+    return [item.strip() for item in raw.splitlines() if item.strip()]
+
+
+_CSS = """
     <style>
     .placeholder-box {
         border: 2px dashed #cbd5f5;
@@ -26,9 +32,16 @@ st.markdown(
         background: #4f46e5;
     }
     </style>
-    """,
-    unsafe_allow_html=True,
-)
+"""
+
+
+@st.cache_resource
+def _inject_css() -> None:
+    """Ship the page styles; Streamlit replays the cached element on reruns."""
+    st.markdown(_CSS, unsafe_allow_html=True)
+
+
+_inject_css()
 
 st.title("Mini Website Playground")
 st.caption("Adjust a few controls in the sidebar and watch the page change right away.")
@@ -72,7 +85,7 @@ else:
         st.write(f"[{secondary_label}](#)")
 
 if show_highlights:
-    items = [item.strip() for item in highlights_raw.splitlines() if item.strip()]
+    items = _parse_highlights(highlights_raw)
     if not items:
         items = ["Add highlight lines in the sidebar"]
     max_items = min(len(items), 3)